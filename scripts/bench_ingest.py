@@ -0,0 +1,318 @@
+""" Offline benchmark for the ingestion pipeline.
+
+Generates synthetic git repositories (many small files, a few huge files, a deep tree, mostly binary
+files, and a repository just under the token limit), serves them as local bare repositories over
+`file://`, and runs the full pipeline on each with per-phase timings, once with a full clone and once
+with a partial clone. Results are written as JSON; pass an earlier result as `--baseline` to flag phases
+that got slower. It also checks that a partial clone leaves out the files over the size limit and that
+an incremental re-ingest (see ingest_incremental) gives the same digest as a fresh ingest; a failed check
+makes the exit status non-zero.
+
+    python scripts/bench_ingest.py --output baseline.json
+    python scripts/bench_ingest.py --baseline baseline.json
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from gitingest.config import MAX_DIRECTORY_DEPTH, MAX_FILE_SIZE
+
+from git_ingest import MAX_INPUT_TOKENS, IngestJob, IngestOptions, run_ingest, write_output
+from ingest_cache import DigestCache
+from ingest_timing import PhaseTimings
+from ingest_walk import count_tokens
+
+WORDS = (
+    "repository ingest token budget digest clone branch commit tree file reader worker cache stream "
+    "pattern include exclude summary content limit partial sparse blob fetch object index offset "
+    "length python async thread queue result error timeout batch phase benchmark baseline"
+).split()
+
+# Scenarios in which a partial clone must download less than a full one
+PARTIAL_CLONE_SAVES = ("huge_files",)
+
+# A phase only counts as a regression if it slowed down by more than this many seconds as well
+NOISE_FLOOR_SECONDS = 0.05
+
+
+def _text(rng, words):
+    lines = []
+    for start in range(0, words, 12):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(min(12, words - start))))
+    return "\n".join(lines) + "\n"
+
+
+def many_small_files(path, rng, scale):
+    """Thousands of small source files spread over a flat-ish tree"""
+    for i in range(int(5000 * scale)):
+        target = path / f"pkg{i % 50}" / f"module_{i}.py"
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_text(f"# module {i}\n" + _text(rng, 10))
+
+
+def huge_files(path, rng, scale):
+    """A few files over the size limit next to a small README"""
+    (path / "README.md").write_text("# Huge files\n" + _text(rng, 200))
+    for i in range(3):
+        with open(path / f"data_{i}.txt", "w") as f:
+            for _ in range(MAX_FILE_SIZE // (1024 * 1024) + 1):
+                f.write(rng.randbytes(512 * 1024).hex())
+
+
+def deep_tree(path, rng, scale):
+    """Chains of directories nested almost to the depth limit, with files at every level"""
+    for chain in range(int(20 * scale)):
+        level = path / f"chain{chain}"
+        for depth in range(MAX_DIRECTORY_DEPTH - 2):
+            level = level / f"d{depth}"
+            level.mkdir(parents=True, exist_ok=True)
+            for i in range(3):
+                (level / f"f{i}.txt").write_text(_text(rng, 20))
+
+
+def binary_heavy(path, rng, scale):
+    """Mostly binary files: some caught by the default ignore patterns, the rest by content sniffing"""
+    (path / "README.md").write_text("# Binary assets\n" + _text(rng, 200))
+    (path / "assets").mkdir()
+    (path / "data").mkdir()
+    for i in range(int(150 * scale)):
+        (path / "assets" / f"image_{i}.png").write_bytes(rng.randbytes(64 * 1024))
+        (path / "data" / f"blob_{i}.dat").write_bytes(b"\x00" + rng.randbytes(64 * 1024))
+
+
+def near_token_limit(path, rng, scale):
+    """Text files adding up to just under the input token limit"""
+    target = int(MAX_INPUT_TOKENS * 0.9)
+    tokens = 0
+    i = 0
+    while tokens < target:
+        text = _text(rng, 2000)
+        tokens += count_tokens(text) + 20  # plus the separator block around each file
+        target_file = path / f"docs{i % 10}" / f"chapter_{i}.md"
+        target_file.parent.mkdir(parents=True, exist_ok=True)
+        target_file.write_text(text)
+        i += 1
+
+
+SCENARIOS = {
+    "many_small_files": many_small_files,
+    "huge_files": huge_files,
+    "deep_tree": deep_tree,
+    "binary_heavy": binary_heavy,
+    "near_token_limit": near_token_limit,
+}
+
+
+def _git(*args, cwd=None):
+    subprocess.run(["git", *args], cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_repo(workdir, name, populate, scale, seed):
+    """Generate a scenario's files, commit them, and return the `file://` URL of a bare copy"""
+    bare = workdir / f"{name}.git"
+    if bare.exists():
+        return bare.as_uri()
+
+    work = workdir / name
+    shutil.rmtree(work, ignore_errors=True)
+    work.mkdir(parents=True)
+    populate(work, random.Random(seed), scale)
+    _git("init", "-q", cwd=work)
+    _git("add", "-A", cwd=work)
+    _git("-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", name, cwd=work)
+    _git("clone", "-q", "--bare", str(work), str(bare))
+    # Let partial clones filter blobs, as GitHub does
+    _git("config", "uploadpack.allowFilter", "true", cwd=bare)
+    _git("config", "uploadpack.allowAnySHA1InWant", "true", cwd=bare)
+    shutil.rmtree(work)
+    return bare.as_uri()
+
+
+def run_once(url, partial_clone, verbose=False):
+    """Ingest `url` end to end, including JSON serialization, and return the result's key numbers"""
+    job = IngestJob(url, timings=PhaseTimings())
+    with _quiet(verbose):
+        output = asyncio.run(run_ingest(job, IngestOptions(partial_clone=partial_clone)))
+        write_output(output, io.StringIO(), job.timings)
+    return {
+        "timings": job.timings.to_dict(),
+        "estimated_tokens": output.get("estimated_tokens"),
+        "bytes_fetched": output.get("clone", {}).get("bytes_fetched"),
+        "error": output.get("code") or output.get("error"),
+    }
+
+
+def _quiet(verbose):
+    # The pipeline logs its progress to stderr; keep the benchmark's own output readable
+    return contextlib.nullcontext() if verbose else contextlib.redirect_stderr(io.StringIO())
+
+
+def check_partial_clone(results):
+    """Check that a partial clone downloaded less than a full one where the scenario allows it"""
+    problems = []
+    for name in PARTIAL_CLONE_SAVES:
+        modes = results["scenarios"].get(name)
+        if modes is None:
+            continue
+        full, partial = modes["full"]["bytes_fetched"], modes["partial"]["bytes_fetched"]
+        if full is None or partial is None or partial >= full:
+            problems.append(f"{name}: partial clone fetched {partial} bytes, full clone {full}")
+    return problems
+
+
+def check_incremental(workdir, seed, verbose=False):
+    """Push a commit that modifies, adds and deletes files, then check that re-ingesting it incrementally
+    from the cached digest of its parent gives the same digest as a fresh ingest. Returns the problems found.
+    """
+    base = Path(tempfile.mkdtemp(prefix="incremental-", dir=workdir))
+    try:
+        url = make_repo(base, "incremental", many_small_files, 0.02, seed)
+        work = base / "work"
+        _git("clone", "-q", url, str(work))
+        files = sorted(work.rglob("module_*.py"))
+        files[0].write_text(files[0].read_text() + "# modified\n")
+        files[1].unlink()
+        (work / "added.py").write_text(_text(random.Random(seed), 50))
+        _git("add", "-A", cwd=work)
+        _git("-c", "user.name=bench", "-c", "user.email=bench@localhost", "commit", "-q", "-m", "change", cwd=work)
+
+        options = IngestOptions(cache=DigestCache(base / "cache"))
+        with _quiet(verbose):
+            asyncio.run(run_ingest(IngestJob(url), options))
+            _git("push", "-q", "origin", "HEAD", cwd=work)
+            incremental = asyncio.run(run_ingest(IngestJob(url), options))
+            fresh = asyncio.run(run_ingest(IngestJob(url), IngestOptions()))
+    finally:
+        shutil.rmtree(base, ignore_errors=True)
+
+    if "error" in incremental or "error" in fresh:
+        return [f"incremental: ingest failed: {incremental.get('error') or fresh.get('error')}"]
+    problems = []
+    if incremental["cache"]["status"] != "incremental":
+        status = incremental["cache"]["status"]
+        problems.append(f"incremental: re-ingest was not incremental (cache status {status!r})")
+    for field in ("summary", "tree", "content", "estimated_tokens"):
+        if incremental[field] != fresh[field]:
+            problems.append(f"incremental: {field} differs from a fresh ingest")
+    return problems
+
+
+def summarize(runs):
+    """Median seconds per phase across repeated runs; counts come from the first run"""
+    first = runs[0]
+    phases = {}
+    for name, values in first["timings"].items():
+        if name == "total_seconds":
+            continue
+        seconds = [run["timings"].get(name, {}).get("seconds", 0.0) for run in runs]
+        phases[name] = dict(values, seconds=round(statistics.median(seconds), 4))
+    return {
+        "total_seconds": round(statistics.median(run["timings"]["total_seconds"] for run in runs), 4),
+        "phases": phases,
+        "estimated_tokens": first["estimated_tokens"],
+        "bytes_fetched": first["bytes_fetched"],
+        "error": first["error"],
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return a line for every total or phase that is more than `threshold` slower than the baseline"""
+    regressions = []
+    for scenario, modes in results["scenarios"].items():
+        for mode, result in modes.items():
+            before = baseline.get("scenarios", {}).get(scenario, {}).get(mode)
+            if before is None:
+                continue
+            pairs = [("total", result["total_seconds"], before["total_seconds"])]
+            pairs += [(name, phase["seconds"], before["phases"].get(name, {}).get("seconds"))
+                      for name, phase in result["phases"].items()]
+            for name, now, then in pairs:
+                if then is None:
+                    continue
+                if now > then * (1 + threshold) and now - then > NOISE_FLOOR_SECONDS:
+                    regressions.append(f"{scenario}/{mode} {name}: {then:.3f}s -> {now:.3f}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the ingestion pipeline on synthetic repositories.")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="scenario to run (repeatable; default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario and clone mode (default: 3)")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiplier for the number of generated files")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the generated content")
+    parser.add_argument("--workdir", help="keep generated repositories here and reuse them on later runs "
+                             "(clear it after changing --scale or --seed)")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's progress output")
+    parser.add_argument("--output", help="write the results as JSON to this file (default: stdout)")
+    parser.add_argument("--baseline", help="earlier results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="slowdown over the baseline reported as a regression (default: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    workdir = Path(args.workdir) if args.workdir else Path(tempfile.mkdtemp(prefix="ingest-bench-"))
+    workdir.mkdir(parents=True, exist_ok=True)
+    git_version = subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip()
+    results = {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "git": git_version,
+            "cpus": os.cpu_count(),
+        },
+        "settings": {"repeat": args.repeat, "scale": args.scale, "seed": args.seed},
+        "scenarios": {},
+    }
+
+    try:
+        for name in args.scenario or SCENARIOS:
+            print(f"Generating {name}...", file=sys.stderr)
+            url = make_repo(workdir, name, SCENARIOS[name], args.scale, args.seed)
+            results["scenarios"][name] = {}
+            for mode in ("full", "partial"):
+                runs = [run_once(url, mode == "partial", args.verbose) for _ in range(max(1, args.repeat))]
+                summary = summarize(runs)
+                results["scenarios"][name][mode] = summary
+                print(f"{name}/{mode}: {summary['total_seconds']:.3f}s", file=sys.stderr)
+
+        print("Checking incremental re-ingest...", file=sys.stderr)
+        problems = check_partial_clone(results) + check_incremental(workdir, args.seed, args.verbose)
+        results["checks"] = {"passed": not problems, "problems": problems}
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+    else:
+        print(text)
+
+    for line in problems:
+        print(f"Check failed: {line}", file=sys.stderr)
+    status = 1 if problems else 0
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text()), args.threshold)
+        for line in regressions:
+            print(f"Regression: {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("No regressions against the baseline", file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
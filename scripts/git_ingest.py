@@ -1,20 +1,89 @@
 from openai import OpenAI
-import re
 try:
-    from gitingest import ingest
-    from gitingest.config import MAX_FILE_SIZE, MAX_TOTAL_SIZE_BYTES, MAX_FILES, MAX_DIRECTORY_DEPTH
+    from gitingest import clone_repo, parse_query
+    from gitingest.config import MAX_FILE_SIZE, MAX_TOTAL_SIZE_BYTES, MAX_FILES, MAX_DIRECTORY_DEPTH, TMP_BASE_PATH
 except ImportError:
     print("Error: gitingest module not found. Please make sure it's installed or in the correct path.")
     exit(1)
+import argparse
+import asyncio
+import contextlib
+import functools
 import json
 import sys
 import tempfile
 import os
+import shutil
+import time
 import traceback
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import unquote, urlparse
+
+from ingest_git import clone as git_clone, objects_size
+from ingest_cache import DEFAULT_CACHE_MAX_BYTES, DigestCache, cache_key, lineage_key, local_head_commit, resolve_commit
+from ingest_incremental import blob_index, can_reingest, reingest
+from ingest_packer import PackedStream, pack_digest
+from ingest_partial import partial_clone
+from ingest_timing import PhaseTimings
+from ingest_walk import DEFAULT_READ_WORKERS, DigestStream, TokenBudgetExceeded, build_digest
 
 # Maximum allowed input tokens
 MAX_INPUT_TOKENS = 250_000
 
+# Default number of concurrent jobs in worker mode
+DEFAULT_WORKERS = 4
+
+@dataclass
+class IngestJob:
+    """A single repository ingestion request"""
+    repo_url: str
+    branch: str = None
+    include_patterns: set = None
+    exclude_patterns: set = None
+    token_budget: int = None
+    timings: PhaseTimings = None  # set to collect per-phase timings for this job
+
+    @classmethod
+    def from_request(cls, request):
+        """Build a job from a decoded JSON request, validating its fields"""
+        repo_url = request.get("repo_url")
+        if not isinstance(repo_url, str) or not repo_url.strip():
+            raise ValueError("Please provide a repository URL")
+        token_budget = request.get("token_budget")
+        if token_budget is not None and (not isinstance(token_budget, int) or token_budget <= 0):
+            raise ValueError("token_budget must be a positive integer")
+        return cls(
+            repo_url=repo_url.strip(),
+            branch=request.get("branch") or None,
+            include_patterns=_as_patterns(request.get("include_patterns")),
+            exclude_patterns=_as_patterns(request.get("exclude_patterns")),
+            token_budget=token_budget,
+            timings=PhaseTimings() if request.get("timings") else None,
+        )
+
+    @property
+    def packing_budget(self):
+        """Token budget to pack to, capped at the model's input limit, or None to reject oversized repos"""
+        if self.token_budget is None:
+            return None
+        return min(self.token_budget, MAX_INPUT_TOKENS)
+
+@dataclass
+class IngestOptions:
+    """Process-wide settings shared by every job"""
+    cache: DigestCache = None
+    read_workers: int = DEFAULT_READ_WORKERS
+    partial_clone: bool = False
+
+def _as_patterns(value):
+    """Normalize a pattern argument (string, list or None) into what gitingest accepts"""
+    if not value:
+        return None
+    if isinstance(value, str):
+        return value
+    return set(value)
+
 def format_size(size_bytes):
     """Convert bytes to human readable format"""
     for unit in ['B', 'KB', 'MB', 'GB']:
@@ -23,127 +92,501 @@ def format_size(size_bytes):
         size_bytes /= 1024.0
     return f"{size_bytes:.1f} GB"
 
-def process_repo(repo_url):
-    print(f"Processing repository: {repo_url}", file=sys.stderr)
-    
-    # Create a temporary file for output
-    with tempfile.NamedTemporaryFile(mode='w+', delete=False) as temp_file:
-        print(f"Created temporary file: {temp_file.name}", file=sys.stderr)
+def limits_info():
+    """Describe the ingestion limits reported alongside every result"""
+    return {
+        "max_file_size": format_size(MAX_FILE_SIZE),
+        "max_total_size": format_size(MAX_TOTAL_SIZE_BYTES),
+        "max_files": MAX_FILES,
+        "max_directory_depth": MAX_DIRECTORY_DEPTH,
+        "max_input_tokens": MAX_INPUT_TOKENS
+    }
+
+def friendly_error(error_message):
+    """Map a raw exception message to a message that can be shown to users"""
+    # Improved error detection for specific error types
+    if "not found" in error_message.lower() or "404" in error_message:
+        return "Repository not found or is private. Please check the URL and ensure you have access permission."
+    elif "rate limit" in error_message.lower() or "rate_limit" in error_message.lower():
+        return "GitHub API rate limit exceeded. Please try again later."
+    elif "timeout" in error_message.lower() or "timed out" in error_message.lower():
+        return "Request timed out while processing the repository. Please try a smaller repository."
+    elif "authentication" in error_message.lower() or "auth" in error_message.lower() or "permission" in error_message.lower():
+        return "Authentication failed or insufficient permissions. The repository may be private."
+    elif "Maximum file size limit" in error_message:
+        return f"Repository contains files larger than the maximum allowed size of {format_size(MAX_FILE_SIZE)}"
+    elif "Maximum number of files" in error_message:
+        return f"Repository exceeds the maximum allowed number of files ({MAX_FILES:,})"
+    elif "Maximum total size limit" in error_message:
+        return f"Repository exceeds the maximum allowed total size of {format_size(MAX_TOTAL_SIZE_BYTES)}"
+    elif "Maximum depth limit" in error_message:
+        return f"Repository exceeds the maximum allowed directory depth of {MAX_DIRECTORY_DEPTH} levels"
+    return error_message
+
+def _limits_key(job):
+    """Ingestion limits that change the digest and therefore belong in the cache key"""
+    return {
+        "max_file_size": MAX_FILE_SIZE,
+        "max_total_size": MAX_TOTAL_SIZE_BYTES,
+        "max_files": MAX_FILES,
+        "max_directory_depth": MAX_DIRECTORY_DEPTH,
+        "max_input_tokens": MAX_INPUT_TOKENS,
+        "token_budget": job.packing_budget,
+    }
+
+def size_warnings(stats):
+    """Describe the traversal limits that cut the ingestion short"""
+    warnings = []
+    if stats.file_limit_reached:
+        warnings.append(f"Repository exceeds maximum file limit of {MAX_FILES:,} files")
+    if stats.size_limit_reached:
+        warnings.append(f"Repository exceeds maximum total size limit of {format_size(MAX_TOTAL_SIZE_BYTES)}")
+    if stats.depth_limit_reached:
+        warnings.append(f"Repository exceeds maximum directory depth of {MAX_DIRECTORY_DEPTH} levels")
+    if stats.large_files_skipped:
+        warnings.append(f"Skipped {stats.large_files_skipped:,} files larger than {format_size(MAX_FILE_SIZE)}")
+    return warnings
+
+def packing_warnings(dropped, budget, files_total):
+    """Describe the files left out to fit a token budget"""
+    if not dropped:
+        return []
+    shown = ", ".join(path.replace(os.sep, "/") for path, _ in dropped[:10])
+    more = f" and {len(dropped) - 10:,} more" if len(dropped) > 10 else ""
+    return [f"Packed to a budget of {budget:,} tokens: dropped {len(dropped):,} of {files_total:,} files ({shown}{more})"]
+
+def dropped_files(dropped):
+    """JSON form of the files left out by packing; tokens is null for files that were never read"""
+    return [{"path": path.replace(os.sep, "/"), "tokens": tokens} for path, tokens in dropped]
+
+async def parse_job(job):
+    """Parse a job's source and patterns into a gitingest query"""
+    file_url = job.repo_url.startswith("file://")
+    query = await parse_query(
+        source=unquote(urlparse(job.repo_url).path) if file_url else job.repo_url,
+        max_file_size=MAX_FILE_SIZE,
+        from_web=False,
+        include_patterns=job.include_patterns,
+        ignore_patterns=job.exclude_patterns,
+    )
+    if file_url:
+        # gitingest only parses URLs of known hosts; parse the path, then treat it as a remote repository
+        path = query.local_path
+        query.url = job.repo_url
+        query.user_name = path.parent.name
+        query.repo_name = path.name.removesuffix(".git")
+        query.slug = f"{query.user_name}-{query.repo_name}"
+    if query.url:
+        query.branch = job.branch or query.branch
+    return query
+
+@contextlib.asynccontextmanager
+async def job_workspace(query):
+    """Give the query a private workspace to fetch its repository into, and remove it when done.
+
+    gitingest's own `ingest` wipes the shared TMP_BASE_PATH when it finishes, which breaks any
+    other ingestion running at the same time. Here every job clones into its own directory and
+    only that directory is cleaned up.
+    """
+    os.makedirs(TMP_BASE_PATH, exist_ok=True)
+    workspace = Path(tempfile.mkdtemp(prefix="job-", dir=TMP_BASE_PATH))
+    try:
+        if query.url:
+            query.local_path = workspace / query.slug
+        yield query
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+def _fetch_ref(query):
+    """The ref to fetch when not cloning: the requested commit, else the branch, else HEAD"""
+    if query.commit:
+        return query.commit
+    # Like gitingest's clone, "main" and "master" mean the default branch
+    if query.branch and query.branch.lower() not in ("main", "master"):
+        return f"refs/heads/{query.branch}"
+    return "HEAD"
+
+async def fetch_repository(query, options, timings=None):
+    """Fetch the query's repository into its workspace.
+
+    A full clone downloads every file; a partial clone (`options.partial_clone`) downloads and checks out
+    only the files the digest will contain, and builds the tree on the way. Returns that prebuilt tree
+    (or None after a full clone), the PartialCheckout (or None) and the clone stats reported in the output.
+    """
+    start = time.perf_counter()
+    if options.partial_clone and query.type != "blob":
+        tree, checkout = await partial_clone(query, _fetch_ref(query))
+        mode = "partial"
+    else:
+        tree, checkout = None, None
+        if query.url.startswith("file://"):
+            await git_clone(query.local_path, query.url, query.branch, query.commit)
+        else:
+            await clone_repo(query.extact_clone_config())
+        mode = "full"
+    seconds = time.perf_counter() - start
+    clone_info = {"mode": mode, "seconds": round(seconds, 3), "bytes_fetched": objects_size(query.local_path)}
+    if timings is not None:
+        timings.add("clone", seconds, bytes=clone_info["bytes_fetched"])
+    return tree, checkout, clone_info
+
+def _pack(query, options, tree, budget, timings):
+    """Walk (unless `tree` is given) and pack a repository, noting how many files it had"""
+    stream = DigestStream(query, read_workers=options.read_workers, tree=tree, timings=timings)
+    return dict(pack_digest(stream, budget), files_total=len(stream.files))
+
+async def build_entry(job, query, options, previous=None):
+    """Build the cache entry for a job inside its workspace, whose repository has not been fetched yet.
+
+    With a `previous` entry of the same lineage, only what changed since is fetched and read; if that
+    fails for any reason other than the token limit, the job falls back to a fresh clone. Entries built
+    while a cache is configured carry the blob index that makes the next re-ingest incremental.
+    Returns the entry, the counts of reused, read and deleted files (None unless incremental) and the
+    clone stats (None for a local directory).
+    """
+    if previous is not None:
         try:
-            # Ingest the repository
-            print("Starting repository ingestion...", file=sys.stderr)
-            summary, tree, content = ingest(repo_url)
-            print("Repository ingestion completed", file=sys.stderr)
-            
-            # Extract estimated token count from summary
-            estimated_tokens = None
-            match = re.search(r"Estimated tokens:\s*([\d.]+)k", summary, re.IGNORECASE)
-            if match:
-                estimated_tokens = int(float(match.group(1)) * 1000)
-                print(f"Estimated tokens: {estimated_tokens}", file=sys.stderr)
-                
-                # Check if estimated tokens exceed the limit
-                if estimated_tokens > MAX_INPUT_TOKENS:
-                    error_msg = f"Repository content exceeds maximum token limit of {MAX_INPUT_TOKENS:,} tokens (estimated {estimated_tokens:,} tokens)"
-                    print(f"Error: {error_msg}", file=sys.stderr)
-                    print(json.dumps({
-                        "error": error_msg,
-                        "limits": {
-                            "max_file_size": format_size(MAX_FILE_SIZE),
-                            "max_total_size": format_size(MAX_TOTAL_SIZE_BYTES),
-                            "max_files": MAX_FILES,
-                            "max_directory_depth": MAX_DIRECTORY_DEPTH,
-                            "max_input_tokens": MAX_INPUT_TOKENS
-                        }
-                    }))
-                    return 1
-            
-            # Check for size limit warnings in the summary
-            size_warnings = []
-            if "Maximum file limit" in summary:
-                warning = f"Repository exceeds maximum file limit of {MAX_FILES:,} files"
-                print(f"Warning: {warning}", file=sys.stderr)
-                size_warnings.append(warning)
-            if "Maximum total size limit" in summary:
-                warning = f"Repository exceeds maximum total size limit of {format_size(MAX_TOTAL_SIZE_BYTES)}"
-                print(f"Warning: {warning}", file=sys.stderr)
-                size_warnings.append(warning)
-            if "Maximum depth limit" in summary:
-                warning = f"Repository exceeds maximum directory depth of {MAX_DIRECTORY_DEPTH} levels"
-                print(f"Warning: {warning}", file=sys.stderr)
-                size_warnings.append(warning)
-            
-            # Write output to temporary file
-            output = {
-                "content": content,
-                "summary": summary,
-                "tree": tree,
-                "estimated_tokens": estimated_tokens,
-                "warnings": size_warnings,
-                "limits": {
-                    "max_file_size": format_size(MAX_FILE_SIZE),
-                    "max_total_size": format_size(MAX_TOTAL_SIZE_BYTES),
-                    "max_files": MAX_FILES,
-                    "max_directory_depth": MAX_DIRECTORY_DEPTH,
-                    "max_input_tokens": MAX_INPUT_TOKENS
-                }
+            built = await reingest(query, previous, _fetch_ref(query), max_tokens=MAX_INPUT_TOKENS,
+                                   read_workers=options.read_workers, timings=job.timings)
+            entry = {
+                "summary": built["summary"],
+                "tree": built["tree"],
+                "content": built["content"],
+                "estimated_tokens": built["estimated_tokens"],
+                "warnings": size_warnings(built["stats"]),
+                "files": built["files"],
+                "blob_sizes": built["blob_sizes"],
+            }
+            clone_info = {
+                "mode": "incremental",
+                "seconds": round(built["fetch_seconds"], 3),
+                "bytes_fetched": objects_size(query.local_path),
             }
-            print("Writing output to temporary file...", file=sys.stderr)
-            temp_file.write(json.dumps(output))
-            temp_file.flush()
-            print("Output written successfully", file=sys.stderr)
-            
-            # Print the output
-            print(json.dumps(output))
-            return 0
+            if job.timings is not None:
+                job.timings.add("clone", built["fetch_seconds"], bytes=clone_info["bytes_fetched"])
+            return entry, built["changes"], clone_info
+        except TokenBudgetExceeded:
+            raise
         except Exception as e:
-            error_message = str(e)
-            print(f"Error occurred: {error_message}", file=sys.stderr)
-            print("Traceback:", file=sys.stderr)
-            traceback.print_exc(file=sys.stderr)
-            
-            # Improved error detection for specific error types
-            if "not found" in error_message.lower() or "404" in error_message:
-                error_message = "Repository not found or is private. Please check the URL and ensure you have access permission."
-            elif "rate limit" in error_message.lower() or "rate_limit" in error_message.lower():
-                error_message = "GitHub API rate limit exceeded. Please try again later."
-            elif "timeout" in error_message.lower() or "timed out" in error_message.lower():
-                error_message = "Request timed out while processing the repository. Please try a smaller repository."
-            elif "authentication" in error_message.lower() or "auth" in error_message.lower() or "permission" in error_message.lower():
-                error_message = "Authentication failed or insufficient permissions. The repository may be private."
-            elif "Maximum file size limit" in error_message:
-                error_message = f"Repository contains files larger than the maximum allowed size of {format_size(MAX_FILE_SIZE)}"
-            elif "Maximum number of files" in error_message:
-                error_message = f"Repository exceeds the maximum allowed number of files ({MAX_FILES:,})"
-            elif "Maximum total size limit" in error_message:
-                error_message = f"Repository exceeds the maximum allowed total size of {format_size(MAX_TOTAL_SIZE_BYTES)}"
-            elif "Maximum depth limit" in error_message:
-                error_message = f"Repository exceeds the maximum allowed directory depth of {MAX_DIRECTORY_DEPTH} levels"
-            
-            print(json.dumps({
-                "error": error_message,
-                "limits": {
-                    "max_file_size": format_size(MAX_FILE_SIZE),
-                    "max_total_size": format_size(MAX_TOTAL_SIZE_BYTES),
-                    "max_files": MAX_FILES,
-                    "max_directory_depth": MAX_DIRECTORY_DEPTH,
-                    "max_input_tokens": MAX_INPUT_TOKENS
-                }
-            }))
-            return 1
-        finally:
-            # Clean up the temporary file
-            try:
-                print(f"Cleaning up temporary file: {temp_file.name}", file=sys.stderr)
-                os.unlink(temp_file.name)
-                print("Temporary file cleaned up successfully", file=sys.stderr)
-            except Exception as e:
-                print(f"Error cleaning up temporary file: {e}", file=sys.stderr)
+            print(f"Incremental re-ingest failed, falling back to a full clone: {e}", file=sys.stderr)
+            shutil.rmtree(query.local_path, ignore_errors=True)
 
-if __name__ == "__main__":
-    if len(sys.argv) != 2:
+    tree, checkout, clone_info = None, None, None
+    if query.url:
+        tree, checkout, clone_info = await fetch_repository(query, options, job.timings)
+
+    # Reading and tokenizing blocks, so it runs on a thread to let other jobs on the event loop proceed
+    if job.packing_budget is not None:
+        built = await asyncio.to_thread(_pack, query, options, tree, job.packing_budget, job.timings)
+        warnings = packing_warnings(built["dropped"], job.packing_budget, built["files_total"])
+    else:
+        built = await asyncio.to_thread(build_digest, query, MAX_INPUT_TOKENS, options.read_workers, tree,
+                                        job.timings)
+        warnings = []
+    entry = {
+        "summary": built["summary"],
+        "tree": built["tree"],
+        "content": built["content"],
+        "estimated_tokens": built["estimated_tokens"],
+        "warnings": size_warnings(built["stats"]) + warnings,
+    }
+    if job.packing_budget is not None:
+        entry["dropped_files"] = dropped_files(built["dropped"])
+    elif options.cache is not None and query.url and query.type != "blob":
+        entry["files"], entry["blob_sizes"] = await blob_index(query, built["index"], checkout)
+    return entry, None, clone_info
+
+async def _cache_call(timings, method, *args):
+    """Run a cache read or write on a thread; a failing cache volume is logged and treated as a miss"""
+    try:
+        with timings.phase("cache"):
+            return await asyncio.to_thread(method, *args)
+    except OSError as e:
+        print(f"Digest cache error, continuing without it: {e}", file=sys.stderr)
+        return None
+
+async def ingest_isolated(job, options):
+    """Clone and ingest a repository inside a private workspace that is removed afterwards.
+
+    When a cache is configured, the ref is first resolved to a commit with `git ls-remote`; if a digest
+    for that commit (and the same patterns and limits) is stored, it is returned without cloning.
+    Otherwise, if an older commit of the same repository was ingested, the digest is rebuilt from it
+    incrementally. Repositories found to be over the token limit are cached as rejections so they fail
+    fast too. Returns the digest dict (summary, tree, content, estimated_tokens, warnings), a cache
+    status dict and the clone stats (None when nothing was fetched).
+    """
+    query = await parse_job(job)
+    cache = options.cache
+    timings = job.timings or PhaseTimings()
+
+    # A .gitingest file in the repository adds to the ignore patterns while it is walked; key on the request's
+    patterns = (set(query.include_patterns or ()), set(query.ignore_patterns or ()))
+
+    def key_for(commit):
+        return cache_key(query.url, query.subpath, commit, *patterns, _limits_key(job))
+
+    cache_info = {"status": "bypass"}
+    clone_info = None
+    previous = None
+    if cache is not None and query.url:
+        lineage = lineage_key(query.url, query.subpath, *patterns, _limits_key(job))
+        commit = query.commit or await resolve_commit(query.url, query.branch)
+        if commit:
+            cache_info = {"status": "miss", "commit": commit}
+            digest = await _cache_call(timings, cache.get, key_for(commit))
+            if digest is not None:
+                print(f"Cache hit for {query.url} at {commit}", file=sys.stderr)
+                if "rejected" in digest:
+                    raise TokenBudgetExceeded.from_dict(digest["rejected"])
+                return digest, {"status": "hit", "commit": commit, **cache.stats()}, None
+            if job.packing_budget is None and query.type != "blob":
+                previous = await _cache_call(timings, cache.latest, lineage)
+                if not can_reingest(previous) or previous.get("commit") == commit:
+                    previous = None
+
+    async with job_workspace(query):
+        budget_error = None
+        changes = None
+        try:
+            entry, changes, clone_info = await build_entry(job, query, options, previous)
+        except TokenBudgetExceeded as e:
+            # Remember the rejection too, so the next request for this commit fails without cloning
+            entry = {"rejected": e.to_dict()}
+            budget_error = e
+
+        if cache_info["status"] == "miss":
+            # Key on what was actually fetched in case the branch moved since ls-remote
+            commit = await local_head_commit(query.local_path) or cache_info["commit"]
+            if "files" in entry:
+                entry["commit"] = commit
+            await _cache_call(timings, cache.put, key_for(commit), entry, lineage if "files" in entry else None)
+            cache_info = {"status": "miss", "commit": commit, **cache.stats()}
+            if changes is not None:
+                cache_info.update(status="incremental", base_commit=previous["commit"], **changes)
+
+        if budget_error is not None:
+            raise budget_error
+        return entry, cache_info, clone_info
+
+def error_result(e):
+    """Build the error output for an exception raised while ingesting"""
+    if isinstance(e, TokenBudgetExceeded):
+        print(f"Error: {e}", file=sys.stderr)
+        return {
+            "error": str(e),
+            "code": "token_limit_exceeded",
+            "estimated_tokens": e.tokens,
+            "files_read": e.files_read,
+            "files_total": e.files_total,
+            "limits": limits_info()
+        }
+
+    error_message = str(e)
+    print(f"Error occurred: {error_message}", file=sys.stderr)
+    print("Traceback:", file=sys.stderr)
+    traceback.print_exception(type(e), e, e.__traceback__, file=sys.stderr)
+    return {"error": friendly_error(error_message), "limits": limits_info()}
+
+async def run_ingest(job, options):
+    """Ingest a repository and return the output dict, or an error dict on failure"""
+    print(f"Processing repository: {job.repo_url}", file=sys.stderr)
+    try:
+        # Ingest the repository
+        print("Starting repository ingestion...", file=sys.stderr)
+        digest, cache_info, clone_info = await ingest_isolated(job, options)
+        print("Repository ingestion completed", file=sys.stderr)
+        print(f"Estimated tokens: {digest['estimated_tokens']}", file=sys.stderr)
+        for warning in digest["warnings"]:
+            print(f"Warning: {warning}", file=sys.stderr)
+
+        output = {
+            "content": digest["content"],
+            "summary": digest["summary"],
+            "tree": digest["tree"],
+            "estimated_tokens": digest["estimated_tokens"],
+            "warnings": digest["warnings"],
+            "limits": limits_info(),
+            "cache": cache_info
+        }
+        if clone_info is not None:
+            output["clone"] = clone_info
+        if job.packing_budget is not None:
+            output["token_budget"] = job.packing_budget
+            output["dropped_files"] = digest["dropped_files"]
+    except Exception as e:
+        output = error_result(e)
+    if job.timings is not None:
+        output["timings"] = job.timings.to_dict()
+    return output
+
+async def stream_ingest(job, options, out):
+    """Ingest a repository, writing NDJSON records to `out` as files are read.
+
+    Records are a header (tree, file count, warnings, limits), one record per file in digest order,
+    and a trailer (summary, token total). Any failure, including going over the token limit part way
+    through, ends the stream with an error record. With a token budget, files come most relevant
+    first and the trailer lists those that were dropped. Returns the process exit status.
+    """
+    def emit(record):
+        start = time.perf_counter()
+        line = json.dumps(record) + "\n"
+        if job.timings is not None:
+            job.timings.add("json", time.perf_counter() - start, bytes=len(line))
+        out.write(line)
+        out.flush()
+
+    print(f"Streaming repository: {job.repo_url}", file=sys.stderr)
+    try:
+        query = await parse_job(job)
+        async with job_workspace(query):
+            tree, clone_info = None, None
+            if query.url:
+                tree, _, clone_info = await fetch_repository(query, options, job.timings)
+            if job.packing_budget is not None:
+                stream = DigestStream(query, read_workers=options.read_workers, tree=tree, timings=job.timings)
+                records = PackedStream(stream, job.packing_budget)
+            else:
+                stream = DigestStream(query, max_tokens=MAX_INPUT_TOKENS, read_workers=options.read_workers, tree=tree,
+                                      timings=job.timings)
+                records = stream
+            header = {
+                "type": "header",
+                "tree": stream.tree,
+                "files_total": len(stream.files),
+                "warnings": size_warnings(stream.stats),
+                "limits": limits_info()
+            }
+            if clone_info is not None:
+                header["clone"] = clone_info
+            emit(header)
+            for record in records:
+                emit({
+                    "type": "file",
+                    "path": record.node.path_str.replace(os.sep, "/"),
+                    "content": record.text,
+                    "tokens": record.tokens
+                })
+            trailer = {
+                "type": "trailer",
+                "summary": records.summary(),
+                "estimated_tokens": records.tokens
+            }
+            if job.packing_budget is not None:
+                trailer["files"] = records.kept
+                trailer["token_budget"] = job.packing_budget
+                trailer["warnings"] = packing_warnings(records.dropped, job.packing_budget, len(stream.files))
+                trailer["dropped_files"] = dropped_files(records.dropped)
+            else:
+                trailer["files"] = stream.files_read
+            if job.timings is not None:
+                trailer["timings"] = job.timings.to_dict()
+            emit(trailer)
+        return 0
+    except Exception as e:
+        error = {"type": "error", **error_result(e)}
+        if job.timings is not None:
+            error["timings"] = job.timings.to_dict()
+        emit(error)
+        return 1
+
+async def ingest_request(request, options):
+    """Run one decoded JSON request (used by batch mode, and by worker mode through handle_request)"""
+    try:
+        job = IngestJob.from_request(request)
+    except ValueError as e:
+        return {"error": str(e)}
+    return await run_ingest(job, options)
+
+def handle_request(request, options):
+    """Run one decoded JSON request to completion on its own event loop (used by worker mode)"""
+    return asyncio.run(ingest_request(request, options))
+
+def process_repo(repo_url, options=None, stream=False, token_budget=None, timings=False):
+    options = options or IngestOptions()
+    job = IngestJob(repo_url, token_budget=token_budget, timings=PhaseTimings() if timings else None)
+    if stream:
+        return asyncio.run(stream_ingest(job, options, sys.stdout))
+
+    output = asyncio.run(run_ingest(job, options))
+    write_output(output, sys.stdout, job.timings)
+    return 1 if "error" in output else 0
+
+def write_output(output, out, timings=None):
+    """Write a result as one JSON line, timing its serialization when `timings` is given"""
+    if timings is None:
+        # Serialize straight to the output rather than building the whole JSON string in memory first
+        json.dump(output, out)
+        out.write("\n")
+        return
+
+    # Time serializing everything else, then splice in the timings (which now include that) as the last key
+    output = {key: value for key, value in output.items() if key != "timings"}
+    with timings.phase("json"):
+        text = json.dumps(output)
+    timings.add("json", 0.0, bytes=len(text))
+    out.write(f'{text[:-1]}, "timings": {json.dumps(timings.to_dict())}}}\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingest a Git repository into a prompt-ready digest.")
+    parser.add_argument("repo_url", nargs="?", help="repository URL to ingest")
+    parser.add_argument("--worker", action="store_true",
+                        help="stay resident and read JSON-lines jobs from stdin, writing one result per line")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="ingest every JSON-lines job in FILE ('-' for stdin) concurrently, writing one result per line")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help=f"number of concurrent jobs in worker and batch modes (default: {DEFAULT_WORKERS})")
+    parser.add_argument("--timeout", type=float,
+                        help="per-job timeout in seconds in batch mode (default: none)")
+    parser.add_argument("--cache-dir", default=os.environ.get("GITINGEST_CACHE_DIR"),
+                        help="directory for the commit-keyed digest cache (default: $GITINGEST_CACHE_DIR, disabled if unset)")
+    parser.add_argument("--cache-max-bytes", type=int, default=DEFAULT_CACHE_MAX_BYTES,
+                        help=f"size budget for the digest cache in bytes (default: {DEFAULT_CACHE_MAX_BYTES})")
+    parser.add_argument("--read-workers", type=int, default=DEFAULT_READ_WORKERS,
+                        help=f"threads reading and tokenizing files per job (default: {DEFAULT_READ_WORKERS})")
+    parser.add_argument("--token-budget", type=int,
+                        help=f"instead of rejecting repositories over the token limit, pack the most relevant files "
+                             f"into this many tokens (capped at {MAX_INPUT_TOKENS:,})")
+    parser.add_argument("--partial-clone", action="store_true",
+                        help="download and check out only the files the digest will contain, instead of the whole repository")
+    parser.add_argument("--timings", action="store_true",
+                        help="add per-phase timings, byte counts and file counts to the output")
+    parser.add_argument("--stream", action="store_true",
+                        help="write NDJSON records (header, one per file, trailer) as files are read")
+    args = parser.parse_args(argv)
+
+    cache = DigestCache(args.cache_dir, args.cache_max_bytes) if args.cache_dir else None
+    options = IngestOptions(cache=cache, read_workers=args.read_workers, partial_clone=args.partial_clone)
+
+    if args.worker:
+        from ingest_worker import serve
+        status = serve(functools.partial(handle_request, options=options), workers=max(1, args.workers))
+        if cache is not None:
+            print(f"Digest cache stats: {cache.stats()}", file=sys.stderr)
+        return status
+
+    if args.batch:
+        from ingest_batch import run_batch
+        run_job = functools.partial(ingest_request, options=options)
+        workers = max(1, args.workers)
+        if args.batch == "-":
+            status = asyncio.run(run_batch(run_job, workers, args.timeout))
+        else:
+            with open(args.batch, encoding="utf-8") as infile:
+                status = asyncio.run(run_batch(run_job, workers, args.timeout, infile=infile))
+        if cache is not None:
+            print(f"Digest cache stats: {cache.stats()}", file=sys.stderr)
+        return status
+
+    if not args.repo_url:
         print(json.dumps({"error": "Please provide a repository URL"}))
-        sys.exit(1)
-    
-    repo_url = sys.argv[1]
-    sys.exit(process_repo(repo_url)) 
\ No newline at end of file
+        return 1
+
+    if args.token_budget is not None and args.token_budget <= 0:
+        print(json.dumps({"error": "--token-budget must be a positive integer"}))
+        return 1
+
+    return process_repo(args.repo_url, options, stream=args.stream, token_budget=args.token_budget,
+                        timings=args.timings)
+
+if __name__ == "__main__":
+    sys.exit(main())
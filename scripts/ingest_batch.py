@@ -0,0 +1,90 @@
+""" Batch mode for git_ingest.py.
+
+Reads one JSON job per line from a file or stdin, e.g. {"repo_url": "https://github.com/user/repo",
+"branch": "dev"}, and runs them concurrently on one event loop with a global cap on jobs in flight and
+a timeout per job. One JSON result or error line is written per job as it finishes, tagged with the
+job's id (or its line number) and URL, so a failing repository never stops the others. A throughput
+summary goes to stderr at the end.
+"""
+
+import asyncio
+import json
+import sys
+import time
+
+from ingest_worker import parse_job_line, prepare_output
+
+
+async def run_batch(run_job, concurrency, timeout=None, infile=None, outfile=None):
+    """Run every job in `infile` with at most `concurrency` in flight; returns the process exit status.
+
+    `run_job(request)` is a coroutine returning a result dict, with an "error" key on failure.
+    """
+    infile = infile or sys.stdin
+    write = prepare_output(outfile)
+    slots = asyncio.Semaphore(concurrency)
+    counts = {"jobs": 0, "succeeded": 0, "failed": 0, "timed_out": 0}
+    estimated_tokens = 0
+
+    async def run(job_id, request):
+        nonlocal estimated_tokens
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(run_job(request), timeout)
+        except asyncio.TimeoutError:
+            result = {"error": f"Job timed out after {timeout:g} seconds", "code": "timeout"}
+            counts["timed_out"] += 1
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            slots.release()
+
+        if "error" in result:
+            counts["failed"] += 1
+        else:
+            counts["succeeded"] += 1
+            estimated_tokens += result.get("estimated_tokens", 0)
+        write({"id": job_id, "repo_url": request.get("repo_url"), **result,
+               "seconds": round(time.perf_counter() - start, 3)})
+
+    print(f"Batch ingest running up to {concurrency} jobs at a time", file=sys.stderr)
+    started = time.perf_counter()
+    tasks = set()
+    line_number = 0
+    while True:
+        # Read on a thread so a slow stdin does not stall the jobs already running
+        line = await asyncio.to_thread(infile.readline)
+        if not line:
+            break
+        line_number += 1
+        try:
+            request = parse_job_line(line)
+        except ValueError as e:
+            counts["jobs"] += 1
+            counts["failed"] += 1
+            write({"id": line_number, "error": f"Invalid job: {e}"})
+            continue
+        if request is None:
+            continue
+
+        counts["jobs"] += 1
+
+        # Wait for a free slot before reading on, so the backlog stays bounded
+        await slots.acquire()
+        task = asyncio.create_task(run(request.get("id", line_number), request))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    if tasks:
+        await asyncio.wait(tasks)
+
+    elapsed = time.perf_counter() - started
+    summary = {
+        **counts,
+        "seconds": round(elapsed, 3),
+        "jobs_per_second": round(counts["jobs"] / elapsed, 3) if elapsed else None,
+        "estimated_tokens": estimated_tokens,
+        "tokens_per_second": round(estimated_tokens / elapsed) if elapsed else None,
+    }
+    print(f"Batch summary: {json.dumps(summary)}", file=sys.stderr)
+    return 0 if counts["failed"] == 0 else 1
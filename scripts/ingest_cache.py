@@ -0,0 +1,183 @@
+""" Commit-keyed on-disk cache of ingestion digests.
+
+An entry is keyed by everything that determines the digest: the normalized repository URL and subpath,
+the commit SHA the ref resolves to, the include/exclude patterns and the ingestion limits. Because the
+commit is part of the key, entries never go stale; they are only evicted (least recently used first)
+once the cache directory grows past its size budget.
+
+Each entry is also registered as the latest digest of its lineage (the same key without the commit), so
+when a branch moves the previous digest can be found and re-ingested incrementally.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from urllib.parse import urlparse
+
+from ingest_git import run_git
+
+# Bump when the stored entry layout changes so old entries are ignored
+CACHE_FORMAT_VERSION = 3
+
+# Default size budget for the cache directory
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # 1 GB
+
+ENTRY_SUFFIX = ".json.gz"
+
+# Lineage pointers are tiny and are not counted against the size budget
+LATEST_SUFFIX = ".latest"
+
+
+def normalize_repo_url(url):
+    """Normalize a repository URL so trivially different spellings share cache entries"""
+    parsed = urlparse(url.strip())
+    path = parsed.path.rstrip("/")
+    if path.endswith(".git"):
+        path = path[:-4]
+    return f"{parsed.scheme.lower()}://{parsed.netloc.lower()}{path}"
+
+
+async def resolve_commit(url, branch=None):
+    """Resolve a branch (or the default branch) to a commit SHA with `git ls-remote`, or None if it cannot be resolved"""
+    ref = f"refs/heads/{branch}" if branch else "HEAD"
+    try:
+        stdout = await run_git("ls-remote", url, ref)
+    except (OSError, RuntimeError):
+        return None
+    for line in stdout.decode().splitlines():
+        sha, _, name = line.partition("\t")
+        if name == ref and sha:
+            return sha
+    return None
+
+
+async def local_head_commit(repo_path):
+    """Return the commit SHA checked out in a local clone, or None"""
+    try:
+        stdout = await run_git("rev-parse", "HEAD", cwd=repo_path)
+    except (OSError, RuntimeError):
+        return None
+    return stdout.decode().strip() or None
+
+
+def cache_key(url, subpath, commit, include_patterns, ignore_patterns, limits):
+    """Build the content address for a digest"""
+    material = {
+        "version": CACHE_FORMAT_VERSION,
+        "url": normalize_repo_url(url),
+        "subpath": subpath,
+        "commit": commit,
+        "include_patterns": sorted(include_patterns or []),
+        "ignore_patterns": sorted(ignore_patterns or []),
+        "limits": limits,
+    }
+    return hashlib.sha256(json.dumps(material, sort_keys=True).encode()).hexdigest()
+
+
+def lineage_key(url, subpath, include_patterns, ignore_patterns, limits):
+    """Key shared by the digests of every commit with the same URL, subpath, patterns and limits"""
+    return cache_key(url, subpath, None, include_patterns, ignore_patterns, limits)
+
+
+class DigestCache:
+    """Size-bounded LRU cache of compressed digests stored in a directory.
+
+    Recency is tracked through file modification times, so the cache survives restarts and can be
+    shared by several processes on the same box. Hit/miss counters are per process.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key):
+        return self.directory / f"{key}{ENTRY_SUFFIX}"
+
+    def get(self, key):
+        """Return the stored entry for `key`, or None on a miss"""
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def latest(self, lineage):
+        """Return the most recently stored entry of a lineage, or None; does not count as a hit or miss"""
+        try:
+            key = (self.directory / f"{lineage}{LATEST_SUFFIX}").read_text().strip()
+        except OSError:
+            return None
+        return self._load(key) if key else None
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path)  # mark as recently used
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError):
+            # Truncated or corrupt entry: drop it and treat as a miss
+            path.unlink(missing_ok=True)
+            return None
+        return entry
+
+    def put(self, key, entry, lineage=None):
+        """Store an entry atomically, then evict old entries if over budget.
+
+        With `lineage`, the entry also becomes the latest one of that lineage.
+        """
+        self._write(self._path(key), json.dumps(entry).encode("utf-8"), compress=True)
+        if lineage is not None:
+            self._write(self.directory / f"{lineage}{LATEST_SUFFIX}", key.encode(), compress=False)
+        self._evict()
+
+    def _write(self, path, data, compress):
+        fd, tmp_name = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw:
+                if compress:
+                    with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as f:
+                        f.write(data)
+                else:
+                    raw.write(data)
+            os.replace(tmp_name, path)
+        except BaseException:
+            Path(tmp_name).unlink(missing_ok=True)
+            raise
+
+    def _evict(self):
+        """Remove least recently used entries until the directory fits in `max_bytes`"""
+        with self._lock:
+            entries = []
+            for path in self.directory.glob(f"*{ENTRY_SUFFIX}"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                path.unlink(missing_ok=True)
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        """Return the hit/miss counters for this process"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,152 @@
+""" Git plumbing used to fetch only the parts of a repository an ingestion needs. """
+
+import asyncio
+import os
+from pathlib import Path
+
+# Never prompt for credentials; a private or missing repository should fail straight away
+GIT_ENV = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+
+# Git file modes for entries that have readable content (regular and executable files)
+FILE_MODES = ("100644", "100755")
+
+
+async def run_git(*args, cwd=None, stdin=None):
+    """Run a git command and return its stdout, raising RuntimeError if it fails.
+
+    The child process is killed if the calling task is cancelled, so per-job timeouts do not leave
+    stray git processes behind.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        "git", *args,
+        cwd=cwd,
+        stdin=asyncio.subprocess.PIPE if stdin is not None else None,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        env=GIT_ENV,
+    )
+    try:
+        stdout, stderr = await proc.communicate(stdin)
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode != 0:
+        raise RuntimeError(f"Command failed: git {' '.join(args)}\nError: {stderr.decode().strip()}")
+    return stdout
+
+
+async def clone(repo_path, url, branch=None, commit=None):
+    """Shallow-clone a repository with the same options as gitingest's `clone_repo`.
+
+    Used for URLs gitingest does not accept, such as `file://` URLs of local bare repositories.
+    """
+    os.makedirs(Path(repo_path).parent, exist_ok=True)
+    args = ["clone", "-q", "--single-branch"]
+    if not commit:
+        args.append("--depth=1")
+        if branch and branch.lower() not in ("main", "master"):
+            args += ["--branch", branch]
+    await run_git(*args, url, str(repo_path))
+    if commit:
+        await run_git("checkout", "-q", commit, cwd=repo_path)
+
+
+async def fetch_tree(repo_path, url, ref, blob_limit=None):
+    """Fetch a single commit and its trees, but no file contents, into a new repository at `repo_path`.
+
+    Returns the SHA of the fetched commit. Blobs are fetched later, only for the files that need reading.
+    With `blob_limit`, blobs smaller than that many bytes are fetched right away instead. The server
+    applies the limit while walking the commit, which is the only way to leave out large blobs without
+    knowing their sizes first (a blob asked for by SHA is always sent, whatever the filter).
+    """
+    blob_filter = "blob:none" if blob_limit is None else f"blob:limit={blob_limit}"
+    os.makedirs(repo_path, exist_ok=True)
+    await run_git("init", "-q", cwd=repo_path)
+    await run_git("remote", "add", "origin", url, cwd=repo_path)
+    await run_git("fetch", "-q", "--depth=1", f"--filter={blob_filter}", "--no-tags", "origin", ref, cwd=repo_path)
+    # Point HEAD at the fetched commit, as a clone would, without checking anything out
+    await run_git("update-ref", "HEAD", "FETCH_HEAD", cwd=repo_path)
+    return (await run_git("rev-parse", "HEAD", cwd=repo_path)).decode().strip()
+
+
+async def list_files(repo_path, commit, subpath="/", sizes=True):
+    """List the regular files of a commit under `subpath` as (path, size, blob SHA) tuples.
+
+    Reading sizes needs the blobs themselves; in a repository fetched without them, pass `sizes=False`
+    (size is then None), otherwise git fetches every blob one request at a time.
+    """
+    args = ["ls-tree", "-r", "-z", "--full-tree"] + (["-l"] if sizes else []) + [commit]
+    subpath = subpath.strip("/")
+    if subpath:
+        args += ["--", subpath]
+    stdout = await run_git(*args, cwd=repo_path)
+
+    files = []
+    for entry in stdout.decode("utf-8", "surrogateescape").split("\0"):
+        if not entry:
+            continue
+        meta, path = entry.split("\t", 1)
+        mode, kind, sha, *size = meta.split()
+        if kind == "blob" and mode in FILE_MODES:
+            files.append((path, int(size[0]) if size else None, sha))
+    return files
+
+
+async def missing_objects(repo_path, commit):
+    """Return the SHAs of objects reachable from `commit` that a filtered fetch left out, without fetching them"""
+    stdout = await run_git("rev-list", "--objects", "--missing=print", commit, cwd=repo_path)
+    return {line[1:].decode() for line in stdout.splitlines() if line.startswith(b"?")}
+
+
+async def blob_sizes(repo_path, shas):
+    """Return {sha: size} for blobs already present in the repository"""
+    if not shas:
+        return {}
+    stdout = await run_git(
+        "cat-file", "--batch-check=%(objectname) %(objectsize)",
+        cwd=repo_path,
+        stdin="".join(f"{sha}\n" for sha in shas).encode(),
+    )
+    sizes = {}
+    for line in stdout.decode().splitlines():
+        sha, size = line.split()
+        sizes[sha] = int(size)
+    return sizes
+
+
+async def fetch_blobs(repo_path, shas):
+    """Fetch the given blobs from origin in a single request (the same request git's partial clone makes)"""
+    if not shas:
+        return
+    await run_git(
+        "-c", "fetch.negotiationAlgorithm=noop",
+        "fetch", "-q", "origin", "--no-tags", "--no-write-fetch-head", "--recurse-submodules=no",
+        "--filter=blob:none", "--stdin",
+        cwd=repo_path,
+        stdin="".join(f"{sha}\n" for sha in shas).encode(),
+    )
+
+
+async def checkout_paths(repo_path, commit, paths):
+    """Write just the given paths of a commit to the working tree"""
+    if not paths:
+        return
+    await run_git(
+        "--literal-pathspecs", "checkout", "-q", commit, "--pathspec-from-file=-", "--pathspec-file-nul", "--",
+        cwd=repo_path,
+        stdin="".join(f"{path}\0" for path in paths).encode("utf-8", "surrogateescape"),
+    )
+
+
+def objects_size(repo_path):
+    """Bytes in a repository's object store, i.e. roughly what was downloaded to build it"""
+    total = 0
+    for dirpath, _, filenames in os.walk(Path(repo_path) / ".git" / "objects"):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                continue
+    return total
@@ -0,0 +1,111 @@
+""" Incremental re-ingestion from the previous digest of the same repository.
+
+A cached digest records, for every file in it, the blob SHA it was read from and where its block sits in
+the content. When the ref has moved, the new commit is fetched as a partial checkout (see ingest_partial).
+Files whose blob is unchanged reuse their block and token count from the previous digest; only added or
+modified files are fetched and read, and deleted files simply drop out of the new tree. Tree, summary and
+token total are then rebuilt from the per-file index, so the result matches a full ingest of the new commit.
+"""
+
+import asyncio
+
+from ingest_git import list_files
+from ingest_partial import PartialCheckout
+from ingest_walk import DEFAULT_READ_WORKERS, DigestStream, TokenBudgetExceeded, assemble_content
+
+
+def can_reingest(entry):
+    """Whether a cached entry carries the per-file index an incremental re-ingest needs"""
+    return entry is not None and "files" in entry and "blob_sizes" in entry
+
+
+async def blob_index(query, index, checkout=None):
+    """Attach blob SHAs to a digest's per-file index, from the clone (or partial checkout) it was built from.
+
+    Returns the index (entries gain a "blob" key, None for files git does not track, such as those in
+    submodules) and {sha: size} for the files under the subpath, which spares a later re-ingest from
+    fetching unchanged blobs just to learn their size.
+    """
+    if checkout is not None:
+        blobs, sizes = checkout.blobs, checkout.sizes
+    else:
+        listing = await list_files(query.local_path, "HEAD", query.subpath)
+        blobs = {path: sha for path, _, sha in listing}
+        sizes = {sha: size for _, size, sha in listing}
+    files = [dict(entry, blob=blobs.get(entry["path"])) for entry in index]
+    return files, sizes
+
+
+async def reingest(query, previous, ref, max_tokens=None, read_workers=DEFAULT_READ_WORKERS, timings=None):
+    """Build the digest of `ref` in an empty `query.local_path`, reusing what is unchanged from `previous`.
+
+    Raises TokenBudgetExceeded as soon as the running total goes over `max_tokens`. Returns the same
+    dict as build_digest plus the commit, blob index and sizes to cache, counts of files reused, read
+    and deleted, and the time spent fetching. Reading and tokenizing go into `timings` when given.
+    """
+    checkout = await PartialCheckout.fetch(query, ref)
+    blobs = checkout.blobs
+    current = set(blobs.values())
+    known_sizes = {sha: size for sha, size in previous["blob_sizes"].items() if sha in current}
+    root, stats = await checkout.build_tree(known_sizes)
+    stream = DigestStream(query, read_workers=read_workers, tree=(root, stats), timings=timings)
+
+    # Reuse the block of every file whose blob is unchanged; everything else is read afresh
+    reusable = {entry["path"]: entry for entry in previous["files"] if entry.get("blob")}
+    content = previous["content"]
+    blocks = {}
+    changed = []
+    for node in stream.files:
+        path = node.path_str.replace("\\", "/")
+        entry = reusable.get(path)
+        if entry is not None and entry["blob"] == blobs.get(path):
+            start = entry["offset"]
+            blocks[id(node)] = (content[start:start + entry["length"]], entry["tokens"])
+        else:
+            changed.append(node)
+
+    stream.tokens += sum(tokens for _, tokens in blocks.values())
+    stream.files_read = len(blocks)
+    _check_budget(stream, max_tokens)
+
+    await checkout.materialize([node.path_str.replace("\\", "/") for node in changed])
+    # Off the event loop, like a full build: the changed files are read and tokenized synchronously
+    content, index = await asyncio.to_thread(_read_changed, stream, changed, blocks, max_tokens)
+
+    new_paths = set(blobs)
+    return {
+        "summary": stream.summary(),
+        "tree": stream.tree,
+        "content": content,
+        "estimated_tokens": stream.tokens,
+        "stats": stats,
+        "commit": checkout.commit,
+        "fetch_seconds": checkout.seconds,
+        "files": [dict(entry, blob=blobs[entry["path"]]) for entry in index],
+        "blob_sizes": checkout.sizes,
+        "changes": {
+            "reused": len(stream.files) - len(changed),
+            "read": len(changed),
+            "deleted": sum(1 for entry in previous["files"] if entry["path"] not in new_paths),
+        },
+    }
+
+
+def _read_changed(stream, changed, blocks, max_tokens):
+    """Read the changed files into `blocks`, keeping the running total, then assemble the content"""
+    records = stream.read_records(changed)
+    try:
+        for record in records:
+            blocks[id(record.node)] = (record.block, record.tokens)
+            stream.tokens += record.tokens
+            stream.files_read += 1
+            _check_budget(stream, max_tokens)
+    finally:
+        records.close()
+    with stream.timings.phase("assemble"):
+        return assemble_content(stream.root, blocks)
+
+
+def _check_budget(stream, max_tokens):
+    if max_tokens is not None and stream.tokens > max_tokens:
+        raise TokenBudgetExceeded(stream.tokens, max_tokens, stream.files_read, len(stream.files))
@@ -0,0 +1,163 @@
+""" Token-budget packing: fill a budget with the files most useful for writing a README.
+
+Instead of rejecting a repository that is over the token budget (or sending every lockfile and generated
+file of one that is under it), files are ranked by how much they tell the model about the project and
+added greedily until the budget is full. Files that do not fit are reported as dropped.
+"""
+
+from fnmatch import fnmatch
+from pathlib import PurePosixPath
+
+from gitingest.filesystem_schema import SEPARATOR, FileSystemNodeType
+from gitingest.output_formatters import _create_summary_string
+
+from ingest_walk import TokenBudgetExceeded, count_tokens, format_token_count
+
+MANIFEST_NAMES = {
+    "package.json", "pyproject.toml", "setup.py", "setup.cfg", "requirements.txt", "pipfile",
+    "cargo.toml", "go.mod", "pom.xml", "build.gradle", "build.gradle.kts", "settings.gradle",
+    "gemfile", "composer.json", "mix.exs", "deno.json", "pubspec.yaml", "cmakelists.txt",
+    "makefile", "dockerfile", "docker-compose.yml", "docker-compose.yaml", "tsconfig.json",
+}
+
+ENTRY_POINT_STEMS = {"main", "index", "app", "cli", "server", "__main__", "lib", "mod", "program"}
+
+LOCKFILE_NAMES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb", "poetry.lock", "pipfile.lock",
+    "cargo.lock", "go.sum", "composer.lock", "gemfile.lock", "mix.lock", "pubspec.lock", "uv.lock",
+}
+
+GENERATED_PATTERNS = {
+    "*.min.js", "*.min.css", "*.map", "*.lock", "*_pb2.py", "*_pb2_grpc.py", "*.pb.go", "*.generated.*",
+    "*.g.dart", "*.snap", "*.svg", "*.csv", "*.tsv",
+}
+
+VENDORED_DIRS = {
+    "vendor", "vendors", "third_party", "third-party", "thirdparty", "external", "node_modules",
+    "dist", "build", "out", "target", ".next", "generated", "__generated__", "site-packages",
+}
+
+TEST_DIRS = {"test", "tests", "__tests__", "spec", "specs", "testing", "e2e", "fixtures", "testdata", "__mocks__"}
+
+TEST_PATTERNS = {"test_*", "*_test.*", "*.test.*", "*.spec.*", "*_spec.*", "conftest.py"}
+
+DOC_SUFFIXES = {".md", ".rst", ".txt", ".adoc"}
+
+# Entry points are only treated specially near the top of the tree (e.g. src/main.py, not a/b/c/main.py)
+ENTRY_POINT_MAX_DEPTH = 2
+
+_block_overhead = None
+
+
+def file_priority(path_str, size):
+    """Sort key ranking a file by README relevance; lower sorts first.
+
+    Order: root READMEs, root manifests, entry points, other docs and nested manifests, sources
+    (shallowest first), tests, then vendored, generated and lock files. Ties break on depth, then size.
+    """
+    path = PurePosixPath(path_str.replace("\\", "/"))
+    dirs = [part.lower() for part in path.parts[:-1]]
+    name = path.name.lower()
+    depth = len(dirs)
+
+    if (any(part in VENDORED_DIRS for part in dirs) or name in LOCKFILE_NAMES
+            or any(fnmatch(name, pattern) for pattern in GENERATED_PATTERNS)):
+        tier = 7
+    elif name.startswith("readme"):
+        tier = 0 if depth == 0 else 3
+    elif name in MANIFEST_NAMES:
+        tier = 1 if depth == 0 else 3
+    elif any(part in TEST_DIRS for part in dirs) or any(fnmatch(name, pattern) for pattern in TEST_PATTERNS):
+        tier = 6
+    elif path.stem.lower() in ENTRY_POINT_STEMS and depth <= ENTRY_POINT_MAX_DEPTH:
+        tier = 2
+    elif path.suffix.lower() in DOC_SUFFIXES:
+        tier = 4
+    else:
+        tier = 5
+
+    return (tier, depth, size, path_str)
+
+
+def _block_overhead_tokens():
+    """Tokens in the separator lines framing every file block; a smaller remaining budget fits no more files"""
+    global _block_overhead
+    if _block_overhead is None:
+        _block_overhead = count_tokens(f"{SEPARATOR}File: \n{SEPARATOR}\n\n")
+    return _block_overhead
+
+
+class PackedStream:
+    """Iterate the files of a DigestStream that fit in `budget` tokens, most relevant first.
+
+    The tree is always included and counts against the budget. Files are read in priority order and
+    kept if they still fit. Reading ahead stops at as many files as the remaining budget could still
+    hold, so once it cannot hold even an empty file block, the rest are dropped without being read.
+    Kept records are yielded in priority order; `dropped` lists (path, tokens) for the others, with
+    tokens None for files that were never read.
+    """
+
+    def __init__(self, stream, budget):
+        self.stream = stream
+        self.budget = budget
+        self.tokens = stream.tokens
+        self.kept = 0
+        self.dropped = []
+
+        if self.tokens > budget:
+            raise TokenBudgetExceeded(self.tokens, budget, 0, len(stream.files))
+
+    def __iter__(self):
+        stream = self.stream
+        if stream.root.type == FileSystemNodeType.FILE:
+            # A single file either fits or it does not; there is nothing to choose between
+            stream.max_tokens = self.budget
+            for record in stream:
+                self.kept += 1
+                yield record
+            self.tokens = stream.tokens
+            return
+
+        ranked = sorted(stream.files, key=lambda node: file_priority(node.path_str, node.size))
+        # Every file block costs at least the overhead, which bounds how many more files could fit
+        records = stream.read_records(ranked, window=lambda: (self.budget - self.tokens) // _block_overhead_tokens())
+        read = 0
+        try:
+            for record in records:
+                read += 1
+                if self.tokens + record.tokens <= self.budget:
+                    self.tokens += record.tokens
+                    self.kept += 1
+                    yield record
+                else:
+                    self.dropped.append((record.node.path_str, record.tokens))
+        finally:
+            records.close()
+
+        self.dropped.extend((node.path_str, None) for node in ranked[read:])
+
+    def summary(self):
+        """Summary string in gitingest's format, noting how many files were packed"""
+        if self.stream.root.type == FileSystemNodeType.FILE:
+            return self.stream.summary()
+        summary = _create_summary_string(self.stream.query, node=self.stream.root)
+        summary += f"Files included: {self.kept} (packed to a budget of {self.budget:,} tokens)\n"
+        return summary + f"\nEstimated tokens: {format_token_count(self.tokens)}"
+
+
+def pack_digest(stream, budget):
+    """Build a packed digest dict: the same fields as build_digest plus the list of dropped files.
+
+    Content keeps gitingest's digest order for the files that were kept.
+    """
+    packed = PackedStream(stream, budget)
+    blocks = {id(record.node): record.block for record in packed}
+
+    return {
+        "summary": packed.summary(),
+        "tree": stream.tree,
+        "content": "\n".join(blocks[id(node)] for node in stream.files if id(node) in blocks),
+        "estimated_tokens": packed.tokens,
+        "stats": stream.stats,
+        "dropped": packed.dropped,
+    }
@@ -0,0 +1,105 @@
+""" Partial clone: download and check out only the files an ingestion will keep.
+
+A full clone downloads every blob of the commit, and the walk then throws away whatever is ignored,
+too large or past the limits. Here the commit is fetched with its trees but no blobs, the file list is
+filtered with the query's patterns, and only the blobs of the files it keeps are read. Blobs over the
+size limit are left out by the server while it walks the commit (`blob:limit`), so they are never
+downloaded: a candidate file whose blob is missing after that fetch is over the limit and is skipped.
+Smaller blobs come with the commit, including those of ignored files, since blobs asked for by SHA would
+bypass the limit. Only the files that made it into the tree are written to disk.
+"""
+
+import time
+from pathlib import Path
+
+from gitingest.ingestion import apply_gitingest_file
+
+from ingest_git import blob_sizes, checkout_paths, fetch_blobs, fetch_tree, list_files, missing_objects
+from ingest_walk import filter_listing, iter_files, tree_from_listing
+
+
+class PartialCheckout:
+    """A commit fetched without blobs into `query.local_path`, whose files are fetched on demand.
+
+    `seconds` accumulates the time spent talking to the remote and writing files out. With a `blob_limit`,
+    blobs of at least that many bytes were left out of the fetch and are never fetched for their size.
+    """
+
+    def __init__(self, query, commit, listing):
+        self.query = query
+        self.commit = commit
+        self.listing = listing
+        self.blobs = {path: sha for path, _, sha in listing}
+        self.fetched = set()
+        self.sizes = {}
+        self.seconds = 0.0
+        self.blob_limit = None
+
+    @classmethod
+    async def fetch(cls, query, ref, blob_limit=None):
+        """Fetch `ref` without blobs (or only those under `blob_limit`) and list the files under the subpath"""
+        start = time.perf_counter()
+        commit = await fetch_tree(query.local_path, query.url, ref, blob_limit)
+        listing = await list_files(query.local_path, commit, query.subpath, sizes=False)
+        checkout = cls(query, commit, listing)
+        if blob_limit is not None:
+            checkout.blob_limit = blob_limit
+            checkout.fetched = set(checkout.blobs.values()) - await missing_objects(query.local_path, commit)
+        checkout.seconds += time.perf_counter() - start
+        return checkout
+
+    async def fetch_blobs(self, shas):
+        """Fetch the blobs not fetched yet, in a single request"""
+        missing = sorted(set(shas) - self.fetched)
+        start = time.perf_counter()
+        await fetch_blobs(self.query.local_path, missing)
+        self.seconds += time.perf_counter() - start
+        self.fetched.update(missing)
+
+    async def materialize(self, paths):
+        """Fetch whatever blobs `paths` still need and write them to the working tree"""
+        await self.fetch_blobs(self.blobs[path] for path in paths)
+        start = time.perf_counter()
+        await checkout_paths(self.query.local_path, self.commit, paths)
+        self.seconds += time.perf_counter() - start
+
+    async def build_tree(self, known_sizes=None):
+        """Apply the repository's .gitingest file and build the node tree, fetching the blobs it may keep.
+
+        `known_sizes` ({sha: size}) spares fetching blobs whose size is already known. Returns
+        (root, stats); the sizes of the candidate blobs are kept in `sizes`.
+        """
+        query = self.query
+        subpath = Path(query.subpath.strip("/"))
+        gitingest_file = (subpath / ".gitingest").as_posix()
+        if gitingest_file in self.blobs:
+            await self.materialize([gitingest_file])
+            apply_gitingest_file(query.local_path / subpath, query)
+
+        candidates = filter_listing(query, self.listing)
+        sizes = {sha: (known_sizes or {}).get(sha) for _, _, sha in candidates}
+        unknown = [sha for sha, size in sizes.items() if size is None]
+        if self.blob_limit is None:
+            await self.fetch_blobs(unknown)
+        else:
+            # A blob the limited fetch left out is at least `blob_limit` bytes, which is all the limits need
+            sizes.update((sha, self.blob_limit) for sha in unknown if sha not in self.fetched)
+            unknown = [sha for sha in unknown if sha in self.fetched]
+        sizes.update(await blob_sizes(query.local_path, unknown))
+        self.sizes = sizes
+
+        # Directories whose files are all filtered out still show in the tree, so list every path;
+        # the size of a file that is not a candidate never matters
+        return tree_from_listing(query, [(path, sizes.get(sha, 0), sha) for path, _, sha in self.listing])
+
+
+async def partial_clone(query, ref):
+    """Fetch and check out only the files the digest of `ref` will contain.
+
+    Returns the prebuilt (root, stats) tree for DigestStream and the PartialCheckout.
+    """
+    # Files larger than max_file_size are skipped, so their blobs need not be downloaded at all
+    checkout = await PartialCheckout.fetch(query, ref, blob_limit=query.max_file_size + 1)
+    root, stats = await checkout.build_tree()
+    await checkout.materialize([node.path_str.replace("\\", "/") for node in iter_files(root)])
+    return (root, stats), checkout
@@ -0,0 +1,48 @@
+""" Per-phase timings for an ingestion: where the time, bytes and files went.
+
+Phases are recorded as they happen and reported in pipeline order. Work done on reader threads (reading
+files and tokenizing them) is summed across threads, so with several threads those phases can add up to
+more than the wall-clock time of the job.
+"""
+
+import contextlib
+import threading
+import time
+
+# Pipeline order used when reporting
+PHASES = ("cache", "clone", "walk", "tree", "read", "tokenize", "assemble", "json")
+
+
+class PhaseTimings:
+    """Thread-safe accumulator of seconds and counts per phase"""
+
+    def __init__(self):
+        self._phases = {}
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def add(self, phase, seconds, **counts):
+        """Add time and counts (e.g. files=1, bytes=n) to a phase"""
+        with self._lock:
+            totals = self._phases.setdefault(phase, {"seconds": 0.0})
+            totals["seconds"] += seconds
+            for name, value in counts.items():
+                totals[name] = totals.get(name, 0) + value
+
+    @contextlib.contextmanager
+    def phase(self, phase, **counts):
+        """Time the body of a `with` block as part of a phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, **counts)
+
+    def to_dict(self):
+        """Phases in pipeline order with rounded seconds, plus the wall-clock time since creation"""
+        with self._lock:
+            phases = dict(self._phases)
+        ordered = sorted(phases, key=lambda name: PHASES.index(name) if name in PHASES else len(PHASES))
+        result = {name: dict(phases[name], seconds=round(phases[name]["seconds"], 4)) for name in ordered}
+        result["total_seconds"] = round(time.perf_counter() - self._started, 4)
+        return result
@@ -0,0 +1,579 @@
+""" Repository traversal and digest building with a running token budget.
+
+This mirrors gitingest's `ingest_query` (same filtering, limits, ordering and output format), but it
+tokenizes each file as it is read and keeps a running total. A repository that goes over the token
+budget is rejected as soon as the total crosses it, instead of after the whole digest has been built
+and re-encoded as one string.
+"""
+
+import functools
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from fnmatch import fnmatch
+from pathlib import Path
+
+import tiktoken
+from gitingest.config import MAX_DIRECTORY_DEPTH, MAX_FILES, MAX_TOTAL_SIZE_BYTES
+from gitingest.filesystem_schema import SEPARATOR, FileSystemNode, FileSystemNodeType, FileSystemStats
+from gitingest.ingestion import apply_gitingest_file
+from gitingest.output_formatters import _create_summary_string, _create_tree_structure
+from gitingest.utils.ingestion_utils import _get_encoding_list, _should_exclude, _should_include
+from gitingest.utils.notebook_utils import process_notebook
+from gitingest.utils.path_utils import _is_safe_symlink
+
+from ingest_timing import PhaseTimings
+
+# Default number of threads reading and tokenizing files
+DEFAULT_READ_WORKERS = 8
+
+# Leading bytes checked for binary markers, matching gitingest's is_textfile
+BINARY_CHECK_BYTES = 1024
+
+_encoding = None
+
+
+class TokenBudgetExceeded(Exception):
+    """Raised when the running token count of a digest goes over the allowed budget"""
+
+    def __init__(self, tokens, limit, files_read, files_total):
+        self.tokens = tokens
+        self.limit = limit
+        self.files_read = files_read
+        self.files_total = files_total
+        super().__init__(
+            f"Repository content exceeds maximum token limit of {limit:,} tokens "
+            f"(reached {tokens:,} tokens after reading {files_read:,} of {files_total:,} files)"
+        )
+
+    def to_dict(self):
+        return {"tokens": self.tokens, "limit": self.limit, "files_read": self.files_read, "files_total": self.files_total}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["tokens"], data["limit"], data["files_read"], data["files_total"])
+
+
+@dataclass
+class WalkStats(FileSystemStats):
+    """Traversal statistics, plus which limits cut the traversal short"""
+
+    file_limit_reached: bool = False
+    size_limit_reached: bool = False
+    depth_limit_reached: bool = False
+    large_files_skipped: int = 0
+
+
+def count_tokens(text):
+    """Count cl100k_base tokens in a string"""
+    global _encoding
+    if _encoding is None:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def format_token_count(tokens):
+    """Format a token count the way gitingest's summary does (e.g. '1.2k', '1.2M')"""
+    if tokens > 1_000_000:
+        return f"{tokens / 1_000_000:.1f}M"
+    if tokens > 1_000:
+        return f"{tokens / 1_000:.1f}k"
+    return str(tokens)
+
+
+def collect_tree(query):
+    """Walk the repository and build the node tree from file metadata only, without reading contents"""
+    subpath = Path(query.subpath.strip("/")).as_posix()
+    path = query.local_path / subpath
+
+    apply_gitingest_file(path, query)
+
+    if not path.exists():
+        raise ValueError(f"{query.slug} cannot be found")
+
+    stats = WalkStats()
+
+    if (query.type and query.type == "blob") or query.local_path.is_file():
+        if not path.is_file():
+            raise ValueError(f"Path {path} is not a file")
+
+        root = FileSystemNode(
+            name=path.name,
+            type=FileSystemNodeType.FILE,
+            size=path.stat().st_size,
+            file_count=1,
+            path_str=str(path.relative_to(query.local_path)),
+            path=path,
+        )
+        return root, stats
+
+    root = FileSystemNode(
+        name=path.name,
+        type=FileSystemNodeType.DIRECTORY,
+        path_str=str(path.relative_to(query.local_path)),
+        path=path,
+    )
+    _walk(root, query, stats)
+    return root, stats
+
+
+def _walk(node, query, stats):
+    """Add the children of a directory node, applying the same filters and limits as gitingest"""
+    if _limit_exceeded(stats, node.depth):
+        return
+
+    for sub_path in node.path.iterdir():
+
+        symlink_path = None
+        if sub_path.is_symlink():
+            if not _is_safe_symlink(sub_path, query.local_path):
+                print(f"Skipping unsafe symlink: {sub_path}", file=sys.stderr)
+                continue
+
+            symlink_path = sub_path
+            sub_path = sub_path.resolve()
+
+        if sub_path in stats.visited:
+            continue
+
+        stats.visited.add(sub_path)
+
+        if query.ignore_patterns and _should_exclude(sub_path, query.local_path, query.ignore_patterns):
+            continue
+
+        if query.include_patterns and not _should_include(sub_path, query.local_path, query.include_patterns):
+            continue
+
+        if sub_path.is_file():
+            _add_file(sub_path, node, query, stats)
+        elif sub_path.is_dir():
+            child = FileSystemNode(
+                name=sub_path.name,
+                type=FileSystemNodeType.DIRECTORY,
+                path_str=str(sub_path.relative_to(query.local_path)),
+                path=sub_path,
+                depth=node.depth + 1,
+            )
+
+            # rename the subdir to reflect the symlink name
+            if symlink_path:
+                child.name = symlink_path.name
+                child.path_str = str(symlink_path)
+
+            _walk(child, query, stats)
+            node.children.append(child)
+            node.size += child.size
+            node.file_count += child.file_count
+            node.dir_count += 1 + child.dir_count
+
+        else:
+            raise ValueError(f"Unexpected error: {sub_path} is neither a file nor a directory")
+
+    node.sort_children()
+
+
+def tree_from_listing(query, files):
+    """Build the node tree from a `git ls-tree` listing instead of walking a checkout.
+
+    `files` holds (path, size, blob) tuples relative to the repository root. The same filters, limits
+    and ordering as `collect_tree` are applied, so the result matches a walk of a full checkout (except
+    for symlinks and submodules, which a listing does not resolve). Nodes point at where each file
+    would be checked out under `query.local_path`; only files that are actually read need to exist.
+    """
+    prefix = Path(query.subpath.strip("/")).as_posix()
+    prefix = "" if prefix == "." else prefix + "/"
+
+    listing = {}
+    for path_str, size, _ in files:
+        if not path_str.startswith(prefix):
+            continue
+        *dirs, name = path_str[len(prefix):].split("/")
+        level = listing
+        for part in dirs:
+            level = level.setdefault(part, {})
+        level[name] = size
+
+    root_path = query.local_path / prefix
+    root = FileSystemNode(
+        name=root_path.name,
+        type=FileSystemNodeType.DIRECTORY,
+        path_str=str(root_path.relative_to(query.local_path)),
+        path=root_path,
+    )
+    stats = WalkStats()
+    _walk_listing(root, listing, query, stats)
+    return root, stats
+
+
+def _walk_listing(node, listing, query, stats):
+    """Listing counterpart of `_walk`: `listing` maps child names to sizes (files) or nested dicts (directories)"""
+    if _limit_exceeded(stats, node.depth):
+        return
+
+    for name, entry in listing.items():
+        sub_path = node.path / name
+        is_dir = isinstance(entry, dict)
+
+        if not _listing_allowed(sub_path, is_dir, query):
+            continue
+
+        if not is_dir:
+            _add_file(sub_path, node, query, stats, size=entry)
+            continue
+
+        child = FileSystemNode(
+            name=name,
+            type=FileSystemNodeType.DIRECTORY,
+            path_str=str(sub_path.relative_to(query.local_path)),
+            path=sub_path,
+            depth=node.depth + 1,
+        )
+        _walk_listing(child, entry, query, stats)
+        node.children.append(child)
+        node.size += child.size
+        node.file_count += child.file_count
+        node.dir_count += 1 + child.dir_count
+
+    node.sort_children()
+
+
+def filter_listing(query, files):
+    """Keep the listing entries that pass the ignore/include patterns and the depth limit.
+
+    Sizes are not needed, so this can run before any blob is fetched. The result is a superset of the
+    files `tree_from_listing` keeps: the size and count limits are applied once sizes are known.
+    """
+    prefix = Path(query.subpath.strip("/")).as_posix()
+    prefix = "" if prefix == "." else prefix + "/"
+    dirs_allowed = {}
+
+    def dir_allowed(dir_str):
+        if dir_str not in dirs_allowed:
+            parent, _, _ = dir_str[len(prefix):].rpartition("/")
+            dirs_allowed[dir_str] = ((not parent or dir_allowed(prefix + parent))
+                                     and _listing_allowed(query.local_path / dir_str, True, query))
+        return dirs_allowed[dir_str]
+
+    kept = []
+    for entry in files:
+        path_str = entry[0]
+        if not path_str.startswith(prefix):
+            continue
+        parent, _, _ = path_str[len(prefix):].rpartition("/")
+        if parent and (parent.count("/") + 1 > MAX_DIRECTORY_DEPTH or not dir_allowed(prefix + parent)):
+            continue
+        if _listing_allowed(query.local_path / path_str, False, query):
+            kept.append(entry)
+    return kept
+
+
+def _listing_allowed(path, is_dir, query):
+    """gitingest's exclude and include checks for a path that may not exist on disk yet"""
+    if query.ignore_patterns and _should_exclude(path, query.local_path, query.ignore_patterns):
+        return False
+    if not query.include_patterns:
+        return True
+    rel_str = str(path.relative_to(query.local_path))
+    if is_dir:
+        rel_str += "/"
+    return any(fnmatch(rel_str, pattern) for pattern in query.include_patterns)
+
+
+def _add_file(path, parent, query, stats, size=None):
+    """Add a file node to its parent if it fits within the size and count limits"""
+    file_size = path.stat().st_size if size is None else size
+    if file_size > query.max_file_size:
+        stats.large_files_skipped += 1
+        return
+
+    if stats.total_size + file_size > MAX_TOTAL_SIZE_BYTES:
+        stats.size_limit_reached = True
+        return
+
+    stats.total_files += 1
+    stats.total_size += file_size
+
+    if stats.total_files > MAX_FILES:
+        stats.file_limit_reached = True
+        return
+
+    parent.children.append(FileSystemNode(
+        name=path.name,
+        type=FileSystemNodeType.FILE,
+        size=file_size,
+        file_count=1,
+        path_str=str(path.relative_to(query.local_path)),
+        path=path,
+        depth=parent.depth + 1,
+    ))
+    parent.size += file_size
+    parent.file_count += 1
+
+
+def _limit_exceeded(stats, depth):
+    """Check the traversal limits, recording which one was hit"""
+    if depth > MAX_DIRECTORY_DEPTH:
+        stats.depth_limit_reached = True
+        return True
+
+    if stats.total_files >= MAX_FILES:
+        stats.file_limit_reached = True
+        return True
+
+    if stats.total_size >= MAX_TOTAL_SIZE_BYTES:
+        stats.size_limit_reached = True
+        return True
+
+    return False
+
+
+def iter_files(node):
+    """Yield file nodes in digest order (the order gitingest concatenates them in)"""
+    if node.type == FileSystemNodeType.FILE:
+        yield node
+        return
+    for child in node.children:
+        yield from iter_files(child)
+
+
+def read_text(path):
+    """Read a file's text the way gitingest's FileSystemNode.content does, but with a single read.
+
+    gitingest opens each file once to sniff for binary markers, again for every candidate encoding
+    to confirm it is text, and again to return the content. Here the file is read once; the binary
+    check runs on its leading bytes and the candidate encodings are tried on the bytes in memory.
+    """
+    if path.suffix == ".ipynb":
+        try:
+            with path.open("rb") as f:
+                head = f.read(BINARY_CHECK_BYTES)
+        except OSError as exc:
+            return f"Error reading file: {exc}"
+        if _looks_binary(head):
+            return "[Non-text file]"
+        try:
+            return process_notebook(path)
+        except Exception as exc:  # pylint: disable=broad-exception-caught
+            return f"Error processing notebook: {exc}"
+
+    try:
+        with path.open("rb") as f:
+            head = f.read(BINARY_CHECK_BYTES)
+            if _looks_binary(head):
+                return "[Non-text file]"
+            data = head + f.read()
+    except OSError as exc:
+        return f"Error reading file: {exc}"
+
+    for encoding in _get_encoding_list():
+        try:
+            text = data.decode(encoding)
+        except (UnicodeDecodeError, LookupError):
+            continue
+        # Text-mode reads translate newlines; keep the output identical to gitingest's
+        return text.replace("\r\n", "\n").replace("\r", "\n")
+
+    return "[Non-text file]"
+
+
+def _looks_binary(head):
+    """Check leading bytes for obvious binary markers"""
+    return b"\x00" in head or b"\xff" in head
+
+
+def file_block(node, text):
+    """Format one file the way it appears in the digest content"""
+    path_str = node.path_str.replace("\\", "/")
+    return f"{SEPARATOR}File: {path_str}\n{SEPARATOR}{text}\n\n"
+
+
+@dataclass
+class FileRecord:
+    """One file as it appears in the digest, with its token count"""
+
+    node: FileSystemNode
+    text: str
+    block: str
+    tokens: int
+
+
+class DigestStream:
+    """A digest built in two phases: the tree is known up front, file contents are read on iteration.
+
+    Iterating yields one FileRecord per file in digest order, keeping a running token total. It raises
+    TokenBudgetExceeded as soon as that total goes over `max_tokens`. Files are read and tokenized by
+    `read_workers` threads, a bounded window ahead of the consumer, so records still come out in a
+    deterministic order and memory stays proportional to the window rather than the repository.
+    Time spent walking, formatting the tree, reading and tokenizing is recorded in `timings`.
+    """
+
+    def __init__(self, query, max_tokens=None, read_workers=DEFAULT_READ_WORKERS, tree=None, timings=None):
+        self.query = query
+        self.max_tokens = max_tokens
+        self.read_workers = max(1, read_workers)
+        self.timings = timings or PhaseTimings()
+
+        # `tree` is a prebuilt (root, stats) pair, e.g. from tree_from_listing; by default the checkout is walked
+        if tree is None:
+            with self.timings.phase("walk"):
+                tree = collect_tree(query)
+        self.root, self.stats = tree
+        self.files = list(iter_files(self.root))
+        self.timings.add("walk", 0.0, files=len(self.files), bytes=self.stats.total_size)
+
+        start = time.perf_counter()
+        if self.root.type == FileSystemNodeType.FILE:
+            self.tree = "Directory structure:\n└── " + self.root.name
+        else:
+            self.tree = "Directory structure:\n" + _create_tree_structure(query, self.root)
+        formatted = time.perf_counter()
+        self.tokens = count_tokens(self.tree)
+        self.timings.add("tree", formatted - start, bytes=len(self.tree.encode()))
+        self.timings.add("tokenize", time.perf_counter() - formatted, tokens=self.tokens)
+        self.files_read = 0
+        self._last_text = ""
+
+    def __iter__(self):
+        for record in self.read_records(self.files):
+            self.tokens += record.tokens
+            self.files_read += 1
+            if self.max_tokens is not None and self.tokens > self.max_tokens:
+                raise TokenBudgetExceeded(self.tokens, self.max_tokens, self.files_read, len(self.files))
+            self._last_text = record.text
+            yield record
+
+    def read_records(self, nodes, window=None):
+        """Yield a FileRecord for each node in the given order, reading up to `read_workers * 4` files ahead.
+
+        `window`, if given, is called before each read and caps how many files may be in flight; once it
+        returns 0, nothing more is read and iteration ends after the files already in flight. This does not
+        touch the running token total; iterate the stream itself for budget-checked records.
+        """
+        read = functools.partial(_read_record, timings=self.timings)
+
+        def limit():
+            ahead = self.read_workers * 4 if self.read_workers > 1 else 1
+            return ahead if window is None else min(ahead, window())
+
+        if self.read_workers == 1:
+            for node in nodes:
+                if limit() <= 0:
+                    return
+                yield read(node)
+            return
+
+        pool = ThreadPoolExecutor(max_workers=self.read_workers, thread_name_prefix="ingest-read")
+        try:
+            pending = deque()
+            files = iter(nodes)
+
+            def fill():
+                while len(pending) < limit():
+                    node = next(files, None)
+                    if node is None:
+                        return
+                    pending.append(pool.submit(read, node))
+
+            fill()
+            while pending:
+                record = pending.popleft().result()
+                fill()
+                yield record
+        finally:
+            # Stop reading ahead if the consumer gave up early (e.g. the token budget was exceeded)
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def summary(self):
+        """Summary string for the files read so far, in gitingest's format"""
+        if self.root.type == FileSystemNodeType.FILE:
+            summary = _single_file_summary(self.query, self.root, self._last_text)
+        else:
+            summary = _create_summary_string(self.query, node=self.root)
+        return summary + f"\nEstimated tokens: {format_token_count(self.tokens)}"
+
+
+def _read_record(node, timings):
+    """Read and tokenize one file (runs on a reader thread)"""
+    start = time.perf_counter()
+    text = read_text(node.path)
+    read = time.perf_counter()
+    block = file_block(node, text)
+    tokens = count_tokens(block)
+    timings.add("read", read - start, files=1, bytes=node.size)
+    timings.add("tokenize", time.perf_counter() - read, tokens=tokens)
+    return FileRecord(node=node, text=text, block=block, tokens=tokens)
+
+
+def build_digest(query, max_tokens=None, read_workers=DEFAULT_READ_WORKERS, tree=None, timings=None):
+    """Build summary, tree and content for a cloned repository, summing token counts per file.
+
+    Raises TokenBudgetExceeded as soon as the running total goes over `max_tokens`.
+    Returns a dict with summary, tree, content, estimated_tokens, the traversal stats, and a per-file
+    index (path, tokens, and the offset and length of the file's block within content).
+    """
+    stream = DigestStream(query, max_tokens, read_workers, tree, timings)
+    blocks = {id(record.node): (record.block, record.tokens) for record in stream}
+    with stream.timings.phase("assemble"):
+        content, index = assemble_content(stream.root, blocks)
+
+    return {
+        "summary": stream.summary(),
+        "tree": stream.tree,
+        "content": content,
+        "estimated_tokens": stream.tokens,
+        "stats": stream.stats,
+        "index": index,
+    }
+
+
+def assemble_content(root, blocks):
+    """Concatenate file blocks with the same per-directory joins as gitingest, so content is byte-identical.
+
+    `blocks` maps id(node) to (block, tokens). Returns the content and a per-file index recording where
+    each block sits in it, which lets a later incremental ingest reuse unchanged blocks without re-reading.
+    """
+    pieces = []
+    index = []
+    offset = 0
+    for piece in _content_pieces(root):
+        if isinstance(piece, str):
+            text = piece
+        else:
+            text, tokens = blocks[id(piece)]
+            index.append({
+                "path": piece.path_str.replace("\\", "/"),
+                "tokens": tokens,
+                "offset": offset,
+                "length": len(text),
+            })
+        pieces.append(text)
+        offset += len(text)
+    return "".join(pieces), index
+
+
+def _content_pieces(node):
+    """Flatten the tree into file nodes and the newline separators gitingest puts between directory entries"""
+    if node.type == FileSystemNodeType.FILE:
+        return [node]
+    pieces = []
+    for position, child in enumerate(node.children):
+        if position:
+            pieces.append("\n")
+        pieces.extend(_content_pieces(child))
+    return pieces
+
+
+def _single_file_summary(query, node, text):
+    """Summary header for a single-file ingestion, matching gitingest's format_single_file"""
+    summary = f"Repository: {query.user_name}/{query.repo_name}\n"
+
+    if query.commit:
+        summary += f"Commit: {query.commit}\n"
+    elif query.branch and query.branch not in ("main", "master"):
+        summary += f"Branch: {query.branch}\n"
+
+    summary += f"File: {node.name}\n"
+    summary += f"Lines: {len(text.splitlines()):,}\n"
+    return summary
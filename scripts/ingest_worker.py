@@ -0,0 +1,81 @@
+""" Long-lived worker mode for git_ingest.py.
+
+Reads one JSON job per line from stdin, e.g. {"id": "abc", "repo_url": "https://github.com/user/repo"},
+runs up to N jobs at a time, and writes one JSON result per line to stdout tagged with the same id.
+Results are written as jobs finish, so they may come back in a different order than they were sent.
+"""
+
+import json
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tiktoken
+
+
+def prepare_output(outfile=None):
+    """Reserve stdout (or `outfile`) for JSON-lines results and return a thread-safe `write(record)` for it.
+
+    Used by worker and batch mode alike. Anything the ingestion libraries print goes to stderr instead,
+    so the output stays one JSON object per line, and the tokenizer is loaded before the first job.
+    """
+    outfile = outfile or sys.stdout
+    sys.stdout = sys.stderr
+    tiktoken.get_encoding("cl100k_base")
+
+    write_lock = threading.Lock()
+
+    def write(record):
+        with write_lock:
+            outfile.write(json.dumps(record) + "\n")
+            outfile.flush()
+
+    return write
+
+
+def parse_job_line(line):
+    """Decode one line of JSON-lines input into a request dict, or None for a blank line.
+
+    Raises ValueError if the line is not a JSON object.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    request = json.loads(line)
+    if not isinstance(request, dict):
+        raise ValueError("Each job must be a JSON object")
+    return request
+
+
+def serve(handle_request, workers, infile=None, outfile=None):
+    """Process JSON-lines jobs until stdin closes, with at most `workers` jobs in flight"""
+    infile = infile or sys.stdin
+    write = prepare_output(outfile)
+    slots = threading.BoundedSemaphore(workers)
+
+    def run(job_id, request):
+        try:
+            result = handle_request(request)
+        except Exception as e:
+            result = {"error": str(e)}
+        finally:
+            slots.release()
+        write({"id": job_id, **result})
+
+    print(f"Ingest worker ready with {workers} workers", file=sys.stderr)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for line in infile:
+            try:
+                request = parse_job_line(line)
+            except ValueError as e:
+                write({"id": None, "error": f"Invalid job: {e}"})
+                continue
+            if request is None:
+                continue
+
+            # Block reading new jobs until a worker is free so the backlog stays bounded
+            slots.acquire()
+            pool.submit(run, request.get("id"), request)
+
+    print("Ingest worker shutting down", file=sys.stderr)
+    return 0